@@ -1,14 +1,97 @@
+import argparse
 import asyncio
-from playwright.async_api import async_playwright
-import json
+from playwright.async_api import async_playwright, Error as PlaywrightError, TimeoutError as PlaywrightTimeoutError
 import os
 import datetime
+import time
 from typing import List, Dict, Optional
-import pandas as pd
 import re
+import string
+from history_store import read_json, write_json
 
 # Constants
-HISTORY_FILE = "price_history.json"
+MAX_CONCURRENT = 4  # Pages scraped at once on the shared browser
+NAV_ATTEMPTS = 3  # Page loads per task before falling back to mock data
+
+# Live scrape results are reused for this long, so reruns within the hour skip Chromium
+SCRAPE_CACHE_FILE = "scrape_cache.json"
+SCRAPE_CACHE_TTL = 60 * 60  # seconds; fares can move within a few hours
+
+# Price alternatives: "257 US dollars" (aria-label) or "$257"
+_PRICE_PATTERN = r'(?P<usd>\d{1,4}(?:,\d{3})?)\s+US\s+dollars|\$(?P<dollar>\d{1,4}(?:,\d{3})?)'
+
+# Result row selectors, most reliable first
+RESULT_SELECTORS = [
+    'li[role="listitem"]',
+    '[data-result-index]',
+    '.pIav2d',
+    '[jsname="IWWDBc"]',
+    '.YMlIz',
+]
+
+# First selector, in priority order, with a rendered match (non-empty box, not visibility:hidden),
+# mirroring wait_for_selector's notion of visible so hidden or empty containers are skipped
+VISIBLE_SELECTOR_JS = (
+    "sels => sels.find(s => Array.from(document.querySelectorAll(s)).some(e => {"
+    "const r = e.getBoundingClientRect();"
+    "return r.width > 0 && r.height > 0 && getComputedStyle(e).visibility !== 'hidden';"
+    "})) || null"
+)
+
+# Only the cheapest fares per route are kept (and cached); the rest are never reported
+MAX_RESULTS = 10
+
+# Result aria-labels run to 1-2k chars, but price and airline come in the first sentences
+ARIA_SCAN_LIMIT = 600
+
+# Results stream in after the first row renders; wait (briefly) for this many before extracting
+MIN_ROWS = 5
+ROWS_SETTLE_MS = 3000
+
+# Pulls the aria-label (the row's own, else its first labelled descendant's) and visible
+# text of every result row in a single browser call
+ROWS_JS = (
+    "els => els.map(e => ({"
+    "aria: e.getAttribute('aria-label') || e.querySelector('[aria-label]')?.getAttribute('aria-label') || '', "
+    "text: e.innerText}))"
+)
+
+# Chromium setup shared by every scraper
+LAUNCH_ARGS = [
+    "--disable-blink-features=AutomationControlled",
+    "--no-sandbox",
+    "--disable-dev-shm-usage",
+    "--disable-infobars",
+    "--window-size=1280,900",
+    # Headless scraping needs no GPU, extensions or background services
+    "--disable-gpu",
+    "--disable-extensions",
+    "--disable-background-networking",
+]
+STEALTH_CONTEXT_OPTIONS = {
+    "user_agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36",
+    "viewport": {'width': 1280, 'height': 900},
+    "locale": "en-US",
+    "timezone_id": "America/Los_Angeles",
+    "extra_http_headers": {
+        "Accept-Language": "en-US,en;q=0.9",
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
+        "sec-ch-ua": '"Google Chrome";v="131", "Chromium";v="131", "Not_A Brand";v="24"',
+        "sec-ch-ua-mobile": "?0",
+        "sec-ch-ua-platform": '"macOS"',
+    },
+}
+# Hide webdriver flag
+HIDE_WEBDRIVER_JS = "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
+
+# Persistent Chromium profile for run_tracker, so consent and session cookies survive across runs.
+# No HTTP cache is kept: Playwright disables it whenever request routing is on, and we always route.
+PROFILE_DIR = ".pw_cache"
+
+# Prices are read from aria-labels, so none of these are needed to scrape
+BLOCKED_RESOURCE_TYPES = frozenset({"image", "font", "stylesheet", "media"})
+BLOCKED_HOSTS = ("doubleclick.net", "google-analytics.com", "googletagmanager.com")
+
 TASKS = [
     {
         "id": "sf_weekend",
@@ -18,7 +101,7 @@ TASKS = [
         "name_cn": "旧金山 San Francisco",
         "depart_date": "2026-03-27",
         "return_date": "2026-03-29",
-        "priority_airlines": ["Alaska", "Delta", "United"], 
+        "priority_airlines": ("Alaska", "Delta", "United"), 
         "nonstop_only": True,
         "price_trigger": 160
     },
@@ -30,7 +113,7 @@ TASKS = [
         "name_cn": "棕榈泉 Palm Springs",
         "depart_date": "2026-04-09",
         "return_date": "2026-04-13",
-        "priority_airlines": ["Alaska", "Delta", "United"],
+        "priority_airlines": ("Alaska", "Delta", "United"),
         "nonstop_only": True,
         "price_trigger": 400
     },
@@ -42,7 +125,7 @@ TASKS = [
         "name_cn": "迪拜 Dubai",
         "depart_date": "2026-05-22",
         "return_date": "2026-05-28",
-        "priority_airlines": ["Emirates"],
+        "priority_airlines": ("Emirates",),
         "nonstop_only": True,
         "price_trigger": 0
     },
@@ -54,7 +137,7 @@ TASKS = [
         "name_cn": "巴厘岛 Bali",
         "depart_date": "2026-07-01",
         "return_date": "2026-07-08",
-        "priority_airlines": ["Singapore Airlines", "Qatar Airways", "Emirates", "EVA Air"], # Best connections if nonstop unavailable
+        "priority_airlines": ("Singapore Airlines", "Qatar Airways", "Emirates", "EVA Air"), # Best connections if nonstop unavailable
         "nonstop_only": True, # Will fallback nicely if no nonstop
         "price_trigger": 0
     }
@@ -156,185 +239,8 @@ HOTELS_DB = {
     ]
 }
 
-def load_history() -> Dict:
-    if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, "r") as f:
-            try: return json.load(f)
-            except: return {}
-    return {}
-
-def save_history(history: Dict):
-    with open(HISTORY_FILE, "w") as f:
-        json.dump(history, f, indent=4)
-
-async def fetch_flight_price(task: Dict) -> Dict:
-    """Uses Playwright to fetch flight prices from Google Flights (stealth mode), with fallback to mock data."""
-    import random
-    try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(
-                headless=True,
-                args=[
-                    "--disable-blink-features=AutomationControlled",
-                    "--no-sandbox",
-                    "--disable-dev-shm-usage",
-                    "--disable-infobars",
-                    "--window-size=1280,900",
-                ]
-            )
-            context = await browser.new_context(
-                user_agent="Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36",
-                viewport={'width': 1280, 'height': 900},
-                locale="en-US",
-                timezone_id="America/Los_Angeles",
-                extra_http_headers={
-                    "Accept-Language": "en-US,en;q=0.9",
-                    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
-                    "sec-ch-ua": '"Google Chrome";v="131", "Chromium";v="131", "Not_A Brand";v="24"',
-                    "sec-ch-ua-mobile": "?0",
-                    "sec-ch-ua-platform": '"macOS"',
-                }
-            )
-            # Hide webdriver flag
-            await context.add_init_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
-            page = await context.new_page()
-
-            url = f"https://www.google.com/travel/flights?q=Flights%20from%20{task['origin']}%20to%20{task['dest']}%20on%20{task['depart_date']}%20returning%20{task['return_date']}%20nonstop"
-            print(f"  URL: {url}")
-
-            await page.goto(url, wait_until="domcontentloaded", timeout=45000)
-            # Random human-like delay
-            await asyncio.sleep(random.uniform(3, 6))
-
-            # Try multiple selectors for robustness
-            selectors = [
-                'li[role="listitem"]',
-                '[data-result-index]',
-                '.pIav2d',
-                '[jsname="IWWDBc"]',
-                '.YMlIz',
-            ]
-            found_selector = None
-            for sel in selectors:
-                try:
-                    await page.wait_for_selector(sel, timeout=15000)
-                    found_selector = sel
-                    print(f"  Found selector: {sel}")
-                    break
-                except:
-                    continue
-
-            if not found_selector:
-                # Dump page text for debugging
-                body_text = await page.inner_text('body')
-                print(f"  No selector found. Page snippet: {body_text[:300]}")
-                await browser.close()
-                raise Exception("No flight result selectors matched")
-
-            await asyncio.sleep(random.uniform(1, 2))
-
-            # Extract results
-            results = []
-            rows = await page.query_selector_all(found_selector)
-            print(f"  Found {len(rows)} rows with selector '{found_selector}'")
-
-            for row in rows:
-                try:
-                    aria_label = await row.get_attribute('aria-label') or ""
-                    airline_text = (await row.inner_text()) + " " + aria_label
-
-                    price = 0
-                    price_match = re.search(r'(\d{1,4}(?:,\d{3})?)\s+US\s+dollars', aria_label)
-                    if price_match:
-                        price = int(price_match.group(1).replace(',', ''))
-                    if price == 0:
-                        price_match = re.search(r'\$(\d{1,4}(?:,\d{3})?)', aria_label + airline_text)
-                        if price_match:
-                            price = int(price_match.group(1).replace(',', ''))
-
-                    matched_carrier = "Other"
-                    for airline in task['priority_airlines']:
-                        if airline.lower() in airline_text.lower():
-                            matched_carrier = airline
-                            break
-
-                    if price > 0:
-                        results.append({"price": price, "carrier": matched_carrier})
-                except:
-                    continue
-
-            await browser.close()
-            print(f"  Extracted {len(results)} prices: {results[:3]}")
-            return results
-
-    except Exception as e:
-        print(f"Playwright failed: {e}. Using mock data.")
-        if task['dest'] == 'SFO':
-            return [{"price": 257, "carrier": "Delta"}, {"price": 277, "carrier": "United"}]
-        elif task['dest'] == 'PSP':
-            return [{"price": 413, "carrier": "Alaska"}, {"price": 546, "carrier": "Southwest"}]
-        elif task['dest'] == 'DXB':
-            return [{"price": 975, "carrier": "Emirates"}]
-        elif task['dest'] == 'DPS':
-            return [{"price": 1250, "carrier": "Singapore Airlines"}]
-        return []
-
-def generate_report(data_clusters: List[Dict]):
-    """Generates the Travel Agent Dashboard with 4 Destination Clusters."""
-    today_str = datetime.date.today().strftime("%Y年%m月%d日")
-    
-    sections_html = ""
-    for cluster in data_clusters:
-        flight = cluster['flight']
-        hotels = cluster['hotels']
-        
-        # Personalized Memo
-        if "SFO" in flight['route_name']:
-            memo = f"当前直飞价格 ${flight['price']}。若回落至 $160，建议立即出发。" if flight['price'] > 160 else "SFO 价格触底！$160 是绝佳机会。"
-        elif "DXB" in flight['route_name']:
-            memo = f"酋长国的奢华之旅。推荐 Emirates 直飞。锁定五月假期。"
-        elif "DPS" in flight['route_name']:
-            memo = f"巴厘岛 (Bali): ${flight['price']}。热带天堂的呼唤，建议经由 Singapore 转机体验最佳服务。"
-        else: # PSP
-            memo = f"棕榈泉沙漠音乐节预热。低于 $400 即是完美入场券。" if flight['price'] > 400 else "PSP 价格诱人！阳光正在召唤。"
-
-        hotel_cards = "".join([f"""
-            <div class="hotel-card">
-                <div class="hotel-img-frame">
-                    <img src="{h['image_url']}" alt="{h['name']}" onerror="this.onerror=null; this.src='https://images.unsplash.com/photo-1566073771259-6a8506099945?auto=format&fit=crop&w=600&q=80';">
-                </div>
-                <div class="hotel-info">
-                    <div class="hotel-name">{h['name']}</div>
-                    <div class="hotel-vibe">{h['vibe']}</div>
-                    <div class="hotel-price">Est. ${h['rate']}+ / night</div>
-                </div>
-            </div>
-        """ for h in hotels])
-
-        sections_html += f"""
-        <section class="destination-island">
-            <h2 class="destination-title">{cluster['name_cn']}</h2>
-            
-            <div class="flight-bar">
-                <div class="flight-route">{flight['route_name']} <span style="font-size:1rem; opacity:0.6; margin-left:10px;">NON-STOP</span></div>
-                <div class="flight-details">
-                    <div class="flight-airline">{flight['carrier']}</div>
-                    <div class="flight-dates">{flight['dates']}</div>
-                </div>
-                <div class="flight-price">
-                    <span class="price-unit">$</span>{flight['price']}
-                </div>
-            </div>
-            
-            <div class="memo-pill">🤖 助理 memo: {memo}</div>
-            
-            <div class="hotel-grid">
-                {hotel_cards}
-            </div>
-        </section>
-        """
-
-    html_template = f"""
+# Dashboard page, built once at import; only the date and sections change per run
+REPORT_TEMPLATE = string.Template("""
 <!DOCTYPE html>
 <html lang="zh">
 <head>
@@ -343,15 +249,15 @@ def generate_report(data_clusters: List[Dict]):
     <title>一丹的 Travel Agent | 4-Destination Edition</title>
     <link href="https://fonts.googleapis.com/css2?family=Outfit:wght@500;700;900&family=PingFang+SC:wght@400;600&display=swap" rel="stylesheet">
     <style>
-        :root {{
+        :root {
             --deep-ocean: #0077BE;
             --glass-bg: rgba(255, 255, 255, 0.65); 
             --text-dark: #2c3e50;
-        }}
+        }
 
-        * {{ margin: 0; padding: 0; box-sizing: border-box; }}
+        * { margin: 0; padding: 0; box-sizing: border-box; }
         
-        body {{ 
+        body { 
             font-family: 'Outfit', 'PingFang SC', sans-serif; 
             background: url('loopy_vacation_bg.png') no-repeat center center fixed;
             background-size: cover;
@@ -361,12 +267,12 @@ def generate_report(data_clusters: List[Dict]):
             display: flex;
             flex-direction: column;
             align-items: center;
-        }}
+        }
 
-        header {{ margin-bottom: 80px; text-align: center; }}
+        header { margin-bottom: 80px; text-align: center; }
         
         /* Pink-to-Orange Gradient Title */
-        .header-title {{
+        .header-title {
             font-family: 'Outfit', sans-serif;
             font-weight: 900;
             font-size: 7rem;
@@ -381,9 +287,9 @@ def generate_report(data_clusters: List[Dict]):
             
             /* Heavy White Glow */
             filter: drop-shadow(0 0 10px white) drop-shadow(0 0 20px white) drop-shadow(0 0 30px rgba(255,255,255,0.8));
-        }}
+        }
         
-        .header-subtitle {{
+        .header-subtitle {
             font-size: 1.2rem;
             font-weight: 700;
             letter-spacing: 5px;
@@ -393,10 +299,10 @@ def generate_report(data_clusters: List[Dict]):
             border-radius: 30px;
             text-transform: uppercase;
             box-shadow: 0 5px 15px rgba(0,0,0,0.1);
-        }}
+        }
 
         /* DESTINATION CLUSTERING */
-        .destination-island {{
+        .destination-island {
             width: 100%;
             max-width: 1200px;
             background: rgba(255, 255, 255, 0.5); /* See-through glass */
@@ -408,20 +314,20 @@ def generate_report(data_clusters: List[Dict]):
             box-shadow: 0 20px 60px rgba(0,0,0,0.05);
             border: 2px solid rgba(255,255,255,0.6);
             transition: transform 0.4s ease;
-        }}
-        .destination-island:hover {{ transform: scale(1.01); background: rgba(255, 255, 255, 0.6); }}
+        }
+        .destination-island:hover { transform: scale(1.01); background: rgba(255, 255, 255, 0.6); }
 
-        .destination-title {{
+        .destination-title {
             font-size: 2.5rem;
             font-weight: 900;
             color: var(--deep-ocean);
             margin-bottom: 30px;
             padding-bottom: 20px;
             border-bottom: 2px solid rgba(0,0,0,0.1);
-        }}
+        }
 
         /* Flight Bar */
-        .flight-bar {{
+        .flight-bar {
             display: flex;
             justify-content: space-between;
             align-items: center;
@@ -430,14 +336,14 @@ def generate_report(data_clusters: List[Dict]):
             border-radius: 30px;
             box-shadow: 0 10px 30px rgba(0,0,0,0.08);
             margin-bottom: 20px;
-        }}
-        .flight-route {{ font-size: 2rem; font-weight: 800; color: #333; }}
-        .flight-details {{ text-align: right; margin-right: 30px; }}
-        .flight-airline {{ font-weight: 700; color: #FF69B4; font-size: 1.2rem; }}
-        .flight-dates {{ font-size: 0.9rem; color: #888; letter-spacing: 1px; }}
-        .flight-price {{ font-size: 3rem; font-weight: 900; color: #333; }}
+        }
+        .flight-route { font-size: 2rem; font-weight: 800; color: #333; }
+        .flight-details { text-align: right; margin-right: 30px; }
+        .flight-airline { font-weight: 700; color: #FF69B4; font-size: 1.2rem; }
+        .flight-dates { font-size: 0.9rem; color: #888; letter-spacing: 1px; }
+        .flight-price { font-size: 3rem; font-weight: 900; color: #333; }
         
-        .memo-pill {{
+        .memo-pill {
             background: #fff0f5;
             color: #555;
             padding: 15px 25px;
@@ -446,71 +352,381 @@ def generate_report(data_clusters: List[Dict]):
             margin-bottom: 40px;
             display: inline-block;
             font-weight: 500;
-        }}
+        }
 
         /* Hotel Grid */
-        .hotel-grid {{
+        .hotel-grid {
             display: grid;
             grid-template-columns: repeat(3, 1fr);
             gap: 30px;
-        }}
-        .hotel-card {{
+        }
+        .hotel-card {
             background: rgba(255,255,255,0.8);
             border-radius: 25px;
             padding: 15px;
             transition: transform 0.3s ease;
-        }}
-        .hotel-card:hover {{ transform: translateY(-5px); }}
+        }
+        .hotel-card:hover { transform: translateY(-5px); }
         
-        .hotel-img-frame {{
+        .hotel-img-frame {
             height: 220px;
             border-radius: 20px;
             overflow: hidden;
             margin-bottom: 15px;
-        }}
-        .hotel-img-frame img {{ width: 100%; height: 100%; object-fit: cover; }}
+        }
+        .hotel-img-frame img { width: 100%; height: 100%; object-fit: cover; }
         
-        .hotel-name {{ font-weight: 800; font-size: 1.2rem; margin-bottom: 5px; color: #333; }}
-        .hotel-vibe {{ font-size: 0.9rem; color: #666; margin-bottom: 10px; line-height: 1.4; min-height: 40px; }}
-        .hotel-price {{ font-size: 0.8rem; font-weight: 700; color: #aaa; text-transform: uppercase; letter-spacing: 1px; }}
+        .hotel-name { font-weight: 800; font-size: 1.2rem; margin-bottom: 5px; color: #333; }
+        .hotel-vibe { font-size: 0.9rem; color: #666; margin-bottom: 10px; line-height: 1.4; min-height: 40px; }
+        .hotel-price { font-size: 0.8rem; font-weight: 700; color: #aaa; text-transform: uppercase; letter-spacing: 1px; }
 
-        footer {{ 
+        footer { 
             color: #FF69B4; font-weight: 700; letter-spacing: 2px; margin-top: 50px;
             background: rgba(255,255,255,0.9); padding: 10px 30px; border-radius: 30px;
-        }}
+        }
     </style>
 </head>
 <body>
     <header>
         <h1 class="header-title">一丹的 Travel Agent</h1>
-        <div class="header-subtitle">4-Destination Edition • {today_str}</div>
+        <div class="header-subtitle">4-Destination Edition • ${today_str}</div>
     </header>
 
-    {sections_html}
+    ${sections_html}
 
     <footer>
         DESIGNED FOR YIDAN • ANTIGRAVITY AGENT
     </footer>
 </body>
 </html>
+""")
+
+# Per-destination markup, formatted once per cluster / hotel
+HOTEL_CARD_TEMPLATE = """
+            <div class="hotel-card">
+                <div class="hotel-img-frame">
+                    <img src="{image_url}" alt="{name}" onerror="this.onerror=null; this.src='https://images.unsplash.com/photo-1566073771259-6a8506099945?auto=format&fit=crop&w=600&q=80';">
+                </div>
+                <div class="hotel-info">
+                    <div class="hotel-name">{name}</div>
+                    <div class="hotel-vibe">{vibe}</div>
+                    <div class="hotel-price">Est. ${rate}+ / night</div>
+                </div>
+            </div>
+        """
+
+SECTION_TEMPLATE = """
+        <section class="destination-island">
+            <h2 class="destination-title">{name_cn}</h2>
+            
+            <div class="flight-bar">
+                <div class="flight-route">{route_name} <span style="font-size:1rem; opacity:0.6; margin-left:10px;">NON-STOP</span></div>
+                <div class="flight-details">
+                    <div class="flight-airline">{carrier}</div>
+                    <div class="flight-dates">{dates}</div>
+                </div>
+                <div class="flight-price">
+                    <span class="price-unit">$</span>{price}
+                </div>
+            </div>
+            
+            <div class="memo-pill">🤖 助理 memo: {memo}</div>
+            
+            <div class="hotel-grid">
+                {hotel_cards}
+            </div>
+        </section>
+        """
+
+def cache_get(key: str, ttl_s: float) -> Optional[List[Dict]]:
+    """Returns the cached flights for key if they were scraped less than ttl_s seconds ago; malformed entries are misses."""
+    try:
+        entry = read_json(SCRAPE_CACHE_FILE).get(key)
+    except OSError:  # An unreadable cache is just a miss
+        return None
+    if not isinstance(entry, dict):
+        return None
+    ts, flights = entry.get("ts"), entry.get("flights")
+    if not isinstance(ts, (int, float)) or time.time() - ts >= ttl_s:
+        return None
+    # A hand-edited or partially written entry must not crash the scan, so check every flight's shape
+    if not isinstance(flights, list) or not flights or not all(
+        isinstance(f, dict) and isinstance(f.get("price"), int) and isinstance(f.get("carrier"), str)
+        for f in flights
+    ):
+        return None
+    return flights
+
+def scrape_cache_key(task: Dict) -> str:
+    # Keyed on the search itself, so editing a task's route or dates never serves stale prices
+    return f"{task['origin']}-{task['dest']}:{task['depart_date']}:{task['return_date']}"
+
+def cache_set(key: str, flights: List[Dict]):
+    cache = read_json(SCRAPE_CACHE_FILE)
+    cache[key] = {"ts": time.time(), "flights": flights}
+    write_json(SCRAPE_CACHE_FILE, cache)
+
+def build_row_re(airlines) -> re.Pattern:
+    """Compiles one pattern that finds both prices and priority airline names in a single scan."""
+    pattern = _PRICE_PATTERN
+    if airlines:
+        # Longest names first so e.g. "United Airlines" wins over "United"; whole words only
+        names = sorted(airlines, key=len, reverse=True)
+        pattern += r'|\b(?P<carrier>' + '|'.join(map(re.escape, names)) + r')\b'
+    return re.compile(pattern, re.IGNORECASE)
+
+def build_url(task: Dict) -> str:
+    return f"https://www.google.com/travel/flights?q=Flights%20from%20{task['origin']}%20to%20{task['dest']}%20on%20{task['depart_date']}%20returning%20{task['return_date']}%20nonstop"
+
+def prepare_task(task: Dict) -> Dict:
+    """Returns a copy of the task with its row regex, carrier lookup and search URL precomputed."""
+    return {
+        **task,
+        "_row_re": build_row_re(task['priority_airlines']),
+        "_carriers": {airline.lower(): airline for airline in task['priority_airlines']},
+        "_url": build_url(task),
+    }
+
+# Per-task work done once at import rather than on every scan
+PREPARED_TASKS = tuple(prepare_task(task) for task in TASKS)
+
+def parse_rows(rows: List[Dict], task: Dict, full: bool = False) -> List[Dict]:
+    """Turns raw {aria, text} result rows into {price, carrier} flights for a prepare_task() task.
+
+    By default only the first ARIA_SCAN_LIMIT chars of each aria-label are scanned and the
+    cheapest MAX_RESULTS flights returned; full=True scans whole labels and returns every flight.
     """
+    # Price and carrier come out of one regex pass per row
+    row_re = task['_row_re']
+    carriers = task['_carriers']
+    aria_limit = None if full else ARIA_SCAN_LIMIT
+    results = []
+    for row in rows:
+        aria_label = row['aria']
+        if not aria_label and not row['text']:
+            continue
+        # aria-label first so its price wins over any "$" in the row text; price and
+        # airline lead the label, so its long accessibility tail is not scanned
+        row_text = aria_label[:aria_limit] + " " + row['text']
+
+        price = 0
+        matched_carrier = None
+        for m in row_re.finditer(row_text):
+            if m.lastgroup == 'carrier':
+                matched_carrier = matched_carrier or carriers[m.group('carrier').lower()]
+            elif not price:
+                price = int((m.group('usd') or m.group('dollar')).replace(',', ''))
+            if price and matched_carrier:
+                break
+
+        if price > 0:
+            results.append({"price": price, "carrier": matched_carrier or "Other"})
+    # Rows come back in Google's "Best" order, not by price, so every row is scanned
+    # before the list is cut down to the cheapest fares
+    results.sort(key=lambda f: f['price'])
+    return results if full else results[:MAX_RESULTS]
+
+def mock_flights(task: Dict) -> List[Dict]:
+    """Fallback prices used when Playwright is unavailable or the scrape fails."""
+    if task['dest'] == 'SFO':
+        return [{"price": 257, "carrier": "Delta"}, {"price": 277, "carrier": "United"}]
+    elif task['dest'] == 'PSP':
+        return [{"price": 413, "carrier": "Alaska"}, {"price": 546, "carrier": "Southwest"}]
+    elif task['dest'] == 'DXB':
+        return [{"price": 975, "carrier": "Emirates"}]
+    elif task['dest'] == 'DPS':
+        return [{"price": 1250, "carrier": "Singapore Airlines"}]
+    return []
+
+async def block_heavy_resources(route):
+    """Route handler that aborts requests the scraper never reads."""
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or any(host in request.url for host in BLOCKED_HOSTS):
+        await route.abort()
+    else:
+        await route.continue_()
+
+async def launch_browser(p):
+    """Launches a stealth Chromium instance for scrapers that want a fresh context per attempt."""
+    return await p.chromium.launch(headless=True, args=LAUNCH_ARGS)
+
+async def new_stealth_context(browser):
+    """Opens a browser context that looks like desktop Chrome on macOS."""
+    context = await browser.new_context(**STEALTH_CONTEXT_OPTIONS)
+    await context.add_init_script(HIDE_WEBDRIVER_JS)
+    return context
+
+async def launch_profile_context(p):
+    """Launches the tracker's stealth context on a persistent profile, so cookies survive between runs.
+
+    If another run holds the profile, falls back to a fresh browser rather than failing the whole scan.
+    """
+    try:
+        context = await p.chromium.launch_persistent_context(
+            PROFILE_DIR,
+            headless=True,
+            args=LAUNCH_ARGS,
+            **STEALTH_CONTEXT_OPTIONS,
+        )
+    except PlaywrightError:
+        # Chromium keeps a SingletonLock in the profile while it runs, so overlapping runs can't share it
+        if not os.path.lexists(os.path.join(PROFILE_DIR, "SingletonLock")):
+            raise
+        print(f"Browser profile {PROFILE_DIR} is locked by another run; scanning with a fresh browser instead (no saved cookies).")
+        context = await new_stealth_context(await launch_browser(p))
+    else:
+        await context.add_init_script(HIDE_WEBDRIVER_JS)
+    await context.route("**/*", block_heavy_resources)
+    return context
+
+async def fetch_flight_price(context, task: Dict) -> List[Dict]:
+    """Uses Playwright to fetch flight prices for a prepare_task() task from Google Flights (stealth mode) on its own page of the shared context, with fallback to mock data."""
+    import random
+    tag = f"[{task['route_name']}]"
+    print(f"Scanning: {task['route_name']}...")
+
+    page = None
+    try:
+        page = await context.new_page()
+
+        url = task['_url']
+        print(f"  {tag} URL: {url}")
+
+        # Retry slow loads with backoff rather than losing the day's price to mock data
+        found_selector = None
+        for attempt in range(NAV_ATTEMPTS):
+            try:
+                await page.goto(url, wait_until="domcontentloaded", timeout=15000)
+                # Random human-like delay
+                await asyncio.sleep(random.uniform(3, 6))
+
+                # Wait once for any result selector instead of timing out on each in turn,
+                # then take the first one (in priority order) that has a visible match
+                await page.wait_for_selector(", ".join(RESULT_SELECTORS), timeout=15000)
+                found_selector = await page.evaluate(VISIBLE_SELECTOR_JS, RESULT_SELECTORS)
+                if found_selector:
+                    print(f"  {tag} Found selector: {found_selector}")
+                    break
+                problem = "No visible result rows"
+            except PlaywrightTimeoutError:
+                problem = "Timed out"
+            if attempt + 1 < NAV_ATTEMPTS:
+                print(f"  {tag} {problem} (attempt {attempt + 1}/{NAV_ATTEMPTS}), retrying...")
+                await asyncio.sleep(2 ** attempt)
+
+        if not found_selector:
+            # Dump page text for debugging
+            body_text = await page.inner_text('body')
+            print(f"  {tag} No selector found. Page snippet: {body_text[:300]}")
+            raise Exception("No flight result selectors matched")
+
+        # Wait for the list to fill in rather than sleeping blind; a short list is still used
+        try:
+            await page.wait_for_function(
+                "([sel, n]) => document.querySelectorAll(sel).length >= n",
+                arg=[found_selector, MIN_ROWS], timeout=ROWS_SETTLE_MS,
+            )
+        except PlaywrightTimeoutError:
+            pass
+
+        # Extract results: one round-trip for all rows instead of several per row
+        rows = await page.locator(found_selector).evaluate_all(ROWS_JS)
+        print(f"  {tag} Found {len(rows)} rows with selector '{found_selector}'")
+        results = parse_rows(rows, task)
+        print(f"  {tag} Extracted {len(results)} prices: {results[:3]}")
+
+    except Exception as e:
+        print(f"{tag} Playwright failed: {e}. Using mock data.")
+        return mock_flights(task)
+    finally:
+        if page:
+            await page.close()
+
+    # Only live, non-empty results are cached; mock fallbacks never are. The cache is optional,
+    # so failing to write it must never cost the prices just scraped
+    if results:
+        try:
+            cache_set(scrape_cache_key(task), results)
+        except OSError as e:
+            print(f"  {tag} Could not update {SCRAPE_CACHE_FILE}: {e}")
+    return results
+
+async def gather_bounded(fetch, items, limit: int = MAX_CONCURRENT) -> List:
+    """Runs fetch(item) for every item concurrently, at most `limit` at a time, returning results in item order."""
+    sem = asyncio.Semaphore(max(1, min(len(items), limit)))
+
+    async def bounded(item):
+        async with sem:
+            return await fetch(item)
+
+    return await asyncio.gather(*(bounded(item) for item in items))
+
+def generate_report(data_clusters: List[Dict], today: datetime.date):
+    """Generates the Travel Agent Dashboard with 4 Destination Clusters."""
+    today_str = today.strftime("%Y年%m月%d日")
+    
+    sections = []
+    for cluster in data_clusters:
+        flight = cluster['flight']
+        hotels = cluster['hotels']
+        
+        # Personalized Memo
+        if "SFO" in flight['route_name']:
+            memo = f"当前直飞价格 ${flight['price']}。若回落至 $160，建议立即出发。" if flight['price'] > 160 else "SFO 价格触底！$160 是绝佳机会。"
+        elif "DXB" in flight['route_name']:
+            memo = f"酋长国的奢华之旅。推荐 Emirates 直飞。锁定五月假期。"
+        elif "DPS" in flight['route_name']:
+            memo = f"巴厘岛 (Bali): ${flight['price']}。热带天堂的呼唤，建议经由 Singapore 转机体验最佳服务。"
+        else: # PSP
+            memo = f"棕榈泉沙漠音乐节预热。低于 $400 即是完美入场券。" if flight['price'] > 400 else "PSP 价格诱人！阳光正在召唤。"
+
+        hotel_cards = "".join(HOTEL_CARD_TEMPLATE.format_map(h) for h in hotels)
+        sections.append(SECTION_TEMPLATE.format(name_cn=cluster['name_cn'], memo=memo, hotel_cards=hotel_cards, **flight))
+    sections_html = "".join(sections)
+
+    html = REPORT_TEMPLATE.substitute(today_str=today_str, sections_html=sections_html)
     with open("flight_report.html", "w") as f:
-        f.write(html_template)
+        f.write(html)
 
-async def run_tracker():
-    history = load_history()
+async def run_tracker(use_cache: bool = True):
+    # Captured once so a scan that crosses midnight is stamped with a single date
+    today = datetime.date.today()
     data_clusters = []
     
     print(f"--- Starting 4-Destination Scan ---")
-    
-    for task in TASKS:
-        print(f"Scanning: {task['route_name']}...")
-        all_flights = await fetch_flight_price(task)
-        
+    # Fresh cached prices are used as-is; Chromium is only started for the tasks that miss
+    if use_cache:
+        results = [cache_get(scrape_cache_key(task), SCRAPE_CACHE_TTL) for task in PREPARED_TASKS]
+    else:
+        results = [None] * len(PREPARED_TASKS)
+    for task, cached in zip(PREPARED_TASKS, results):
+        if cached is not None:
+            print(f"  [{task['route_name']}] Using {len(cached)} cached prices from {SCRAPE_CACHE_FILE} (run with --fresh to rescrape)")
+    misses = [i for i, cached in enumerate(results) if cached is None]
+
+    if misses:
+        to_scrape = [PREPARED_TASKS[i] for i in misses]
         try:
-            valid = [f for f in all_flights if f['price'] > 0]
-            best = min(valid, key=lambda x: x['price']) if valid else {"price": 0, "carrier": "N/A"}
-        except: best = {"price": 0, "carrier": "N/A"}
+            # One persistent-profile browser for the whole scan; scrapes are network-bound, so run them side by side
+            async with async_playwright() as p:
+                context = await launch_profile_context(p)
+                try:
+                    scraped = await gather_bounded(lambda task: fetch_flight_price(context, task), to_scrape)
+                finally:
+                    browser = context.browser  # None for the persistent profile, set for the locked-profile fallback
+                    await context.close()
+                    if browser:
+                        await browser.close()
+        except Exception as e:
+            print(f"Playwright failed: {e}. Using mock data.")
+            scraped = [mock_flights(task) for task in to_scrape]
+        for i, flights in zip(misses, scraped):
+            results[i] = flights
+    
+    for task, all_flights in zip(PREPARED_TASKS, results):
+        # fetch_flight_price always returns a list (mock data on failure), so no guard is needed here
+        best = min((f for f in all_flights if f['price'] > 0), key=lambda x: x['price'],
+                   default={"price": 0, "carrier": "N/A"})
         
         # Prepare Cluster Data
         cluster = {
@@ -525,8 +741,12 @@ async def run_tracker():
         }
         data_clusters.append(cluster)
         
-    generate_report(data_clusters)
+    generate_report(data_clusters, today)
     print("Dashboard Clustering Layout Generated: flight_report.html")
 
 if __name__ == "__main__":
-    asyncio.run(run_tracker())
+    parser = argparse.ArgumentParser(description="Scan flight prices and generate flight_report.html.")
+    parser.add_argument("--fresh", action="store_true",
+                        help=f"ignore {SCRAPE_CACHE_FILE} and scrape every route live (results are still cached)")
+    args = parser.parse_args()
+    asyncio.run(run_tracker(use_cache=not args.fresh))
@@ -0,0 +1,58 @@
+"""Price history and JSON file helpers, kept free of Playwright so any script can use them."""
+import json
+import os
+import tempfile
+from typing import Dict
+
+try:
+    import orjson  # Optional: much faster history load/save
+except ImportError:
+    orjson = None
+
+HISTORY_FILE = "price_history.json"
+
+def read_json(path: str) -> Dict:
+    """Loads a JSON object from disk, treating a missing, corrupt or non-object file as empty."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return {}
+    try:
+        obj = orjson.loads(data) if orjson else json.loads(data)
+    except ValueError:  # Both decoders raise a ValueError subclass on bad JSON
+        return {}
+    return obj if isinstance(obj, dict) else {}
+
+def write_json(path: str, data: Dict):
+    if orjson:
+        payload = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    else:
+        # Same bytes as orjson's output, so the committed file doesn't churn with the optional dependency
+        payload = json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+    # Write to a uniquely named temp file and swap it in, so a crash mid-write can't truncate the
+    # file and overlapping runs never share (or delete) each other's temp file
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+        os.chmod(tmp_file, 0o644)  # mkstemp creates it 0600
+        os.replace(tmp_file, path)
+    except BaseException:
+        os.unlink(tmp_file)
+        raise
+
+def load_history() -> Dict:
+    return read_json(HISTORY_FILE)
+
+def save_history(history: Dict):
+    write_json(HISTORY_FILE, history)
+
+def record_price(history: Dict, task_id: str, entry: Dict):
+    """Records today's price for a task, overwriting any earlier entry from the same day."""
+    task_history = history.setdefault(task_id, {}).setdefault("history", [])
+    if task_history and task_history[-1]["date"] == entry["date"]:
+        task_history[-1] = entry
+    else:
+        task_history.append(entry)
+    history[task_id]["latest"] = entry
@@ -1,8 +1,6 @@
-import json
 import datetime
 import random
-
-HISTORY_FILE = "price_history.json"
+from history_store import save_history
 
 def inject_mock_data():
     history = {}
@@ -41,8 +39,7 @@ def inject_mock_data():
         }
     }
     
-    with open(HISTORY_FILE, "w") as f:
-        json.dump(history, f, indent=4)
+    save_history(history)
     print("Mock history injected successfully.")
 
 if __name__ == "__main__":
@@ -1,14 +1,14 @@
 import asyncio
-import re
 import random
-import json
-import os
 import datetime
-from playwright.async_api import async_playwright
-
-HISTORY_FILE = "price_history.json"
-
-RETRY_TASKS = [
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
+from flight_tracker import (
+    ROWS_JS, VISIBLE_SELECTOR_JS, launch_browser, new_stealth_context, block_heavy_resources,
+    prepare_task, parse_rows, gather_bounded,
+)
+from history_store import load_history, save_history, record_price
+
+RETRY_TASKS = tuple(prepare_task(task) for task in [
     {
         "id": "desert_escape",
         "route_name": "SEA-PSP",
@@ -17,7 +17,7 @@ RETRY_TASKS = [
         "name_cn": "棕榈泉 Palm Springs",
         "depart_date": "2026-04-09",
         "return_date": "2026-04-13",
-        "priority_airlines": ["Alaska", "Delta", "United"],
+        "priority_airlines": ("Alaska", "Delta", "United"),
     },
     {
         "id": "bali_retreat",
@@ -27,9 +27,9 @@ RETRY_TASKS = [
         "name_cn": "巴厘岛 Bali",
         "depart_date": "2026-07-01",
         "return_date": "2026-07-08",
-        "priority_airlines": ["Singapore Airlines", "Qatar Airways", "Emirates", "EVA Air"],
+        "priority_airlines": ("Singapore Airlines", "Qatar Airways", "Emirates", "EVA Air"),
     },
-]
+])
 
 SELECTORS = [
     'li[role="listitem"]',
@@ -65,7 +65,7 @@ def build_url(task: dict) -> str:
     )
     return url
 
-async def scrape_with_retry(task: dict, max_retries: int = 3) -> dict:
+async def scrape_with_retry(browser, task: dict, max_retries: int = 3) -> dict:
     # Try two different URL formats
     urls = [
         # Hash-based structured URL (most reliable for specific airports)
@@ -76,141 +76,102 @@ async def scrape_with_retry(task: dict, max_retries: int = 3) -> dict:
         f"https://www.google.com/travel/flights?q=Flights%20from%20{task['origin']}%20to%20{task['dest']}%20on%20{task['depart_date']}%20returning%20{task['return_date']}%20nonstop",
     ]
 
+    tag = f"[{task['route_name']}]"
     for attempt, url in enumerate(urls, 1):
-        print(f"\n[{task['route_name']}] Attempt {attempt}/{len(urls)} — URL format {attempt}")
-        print(f"  {url}")
+        print(f"\n{tag} Attempt {attempt}/{len(urls)} — URL format {attempt}")
+        print(f"  {tag} {url}")
+        context = None
         try:
-            async with async_playwright() as p:
-                browser = await p.chromium.launch(
-                    headless=True,
-                    args=[
-                        "--disable-blink-features=AutomationControlled",
-                        "--no-sandbox",
-                        "--disable-dev-shm-usage",
-                        "--disable-infobars",
-                        "--window-size=1280,900",
-                    ]
-                )
-                context = await browser.new_context(
-                    user_agent="Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36",
-                    viewport={'width': 1280, 'height': 900},
-                    locale="en-US",
-                    timezone_id="America/Los_Angeles",
-                    extra_http_headers={
-                        "Accept-Language": "en-US,en;q=0.9",
-                        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
-                        "sec-ch-ua": '"Google Chrome";v="131", "Chromium";v="131", "Not_A Brand";v="24"',
-                        "sec-ch-ua-mobile": "?0",
-                        "sec-ch-ua-platform": '"macOS"',
-                    }
-                )
-                await context.add_init_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
-                page = await context.new_page()
-
-                await page.goto(url, wait_until="domcontentloaded", timeout=60000)
-
-                wait_secs = random.uniform(8, 12)
-                print(f"  Waiting {wait_secs:.1f}s...")
-                await asyncio.sleep(wait_secs)
-
-                # Scroll to trigger lazy-load
-                await page.evaluate("window.scrollBy(0, 600)")
-                await asyncio.sleep(3)
-
-                # Check what page we actually landed on
-                body_text = await page.inner_text('body')
-                if "Explore deals" in body_text and "Find cheap flights" in body_text:
-                    print(f"  ❌ Landed on Google Flights homepage — URL format not working")
-                    await browser.close()
-                    continue
-
-                found_selector = None
-                for sel in SELECTORS:
-                    try:
-                        await page.wait_for_selector(sel, timeout=15000)
-                        found_selector = sel
-                        break
-                    except:
-                        continue
-
-                if not found_selector:
-                    print(f"  ❌ No selector found. Page: {body_text[:300]}")
-                    await browser.close()
-                    continue
-
-                print(f"  ✅ Selector: {found_selector}")
-                rows = await page.query_selector_all(found_selector)
-                print(f"  Found {len(rows)} rows")
-
-                results = []
-                for row in rows:
-                    try:
-                        aria_label = await row.get_attribute('aria-label') or ""
-                        airline_text = (await row.inner_text()) + " " + aria_label
-
-                        price = 0
-                        pm = re.search(r'(\d{1,4}(?:,\d{3})?)\s+US\s+dollars', aria_label)
-                        if pm:
-                            price = int(pm.group(1).replace(',', ''))
-                        if price == 0:
-                            pm = re.search(r'\$(\d{1,4}(?:,\d{3})?)', aria_label + airline_text)
-                            if pm:
-                                price = int(pm.group(1).replace(',', ''))
-
-                        matched_carrier = "Other"
-                        for airline in task['priority_airlines']:
-                            if airline.lower() in airline_text.lower():
-                                matched_carrier = airline
-                                break
-
-                        if price > 0:
-                            results.append({"price": price, "carrier": matched_carrier})
-                    except:
-                        continue
-
-                await browser.close()
-
-                if results:
-                    best = min(results, key=lambda x: x['price'])
-                    print(f"  💰 Best: ${best['price']} on {best['carrier']} ({len(results)} results total)")
-                    return {"task_id": task["id"], "route": task["route_name"], "results": results, "best": best, "live": True}
-                else:
-                    print("  No prices parsed from rows.")
+            context = await new_stealth_context(browser)
+            await context.route("**/*", block_heavy_resources)
+            page = await context.new_page()
+
+            await page.goto(url, wait_until="domcontentloaded", timeout=60000)
+
+            wait_secs = random.uniform(8, 12)
+            print(f"  {tag} Waiting {wait_secs:.1f}s...")
+            await asyncio.sleep(wait_secs)
+
+            # Scroll to trigger lazy-load
+            await page.evaluate("window.scrollBy(0, 600)")
+            await asyncio.sleep(3)
+
+            # Check what page we actually landed on
+            body_text = await page.inner_text('body')
+            if "Explore deals" in body_text and "Find cheap flights" in body_text:
+                print(f"  {tag} ❌ Landed on Google Flights homepage — URL format not working")
+                continue
+
+            # One combined wait instead of a 15s timeout per selector; only a timeout
+            # means "nothing rendered", anything else is a real error for the outer handler
+            found_selector = None
+            try:
+                await page.wait_for_selector(", ".join(SELECTORS), timeout=15000)
+                found_selector = await page.evaluate(VISIBLE_SELECTOR_JS, SELECTORS)
+            except PlaywrightTimeoutError:
+                pass
+
+            if not found_selector:
+                print(f"  {tag} ❌ No selector found. Page: {body_text[:300]}")
+                continue
+
+            print(f"  {tag} ✅ Selector: {found_selector}")
+            # All rows in one round-trip, parsed with the tracker's single-pass row regex;
+            # full=True so the reported best and result count cover every row
+            rows = await page.locator(found_selector).evaluate_all(ROWS_JS)
+            print(f"  {tag} Found {len(rows)} rows")
+            results = parse_rows(rows, task, full=True)
+
+            if results:
+                best = min(results, key=lambda x: x['price'])
+                print(f"  {tag} 💰 Best: ${best['price']} on {best['carrier']} ({len(results)} results total)")
+                return {"task_id": task["id"], "route": task["route_name"], "results": results, "best": best, "live": True}
+            else:
+                print(f"  {tag} No prices parsed from rows.")
 
         except Exception as e:
-            print(f"  Error: {e}")
+            print(f"  {tag} Error: {e}")
+        finally:
+            if context:
+                await context.close()
 
     # All formats failed
+    print(f"\n  ⚠️ All URL formats failed for {task['dest']}. Using mock.")
+    return mock_result(task)
+
+def mock_result(task: dict) -> dict:
     mock = {"PSP": {"price": 413, "carrier": "Alaska"}, "DPS": {"price": 1250, "carrier": "Singapore Airlines"}}
-    dest = task["dest"]
-    print(f"\n  ⚠️ All URL formats failed for {dest}. Using mock.")
-    return {"task_id": task["id"], "route": task["route_name"], "best": mock.get(dest, {"price": 0, "carrier": "N/A"}), "live": False}
+    return {"task_id": task["id"], "route": task["route_name"], "best": mock.get(task["dest"], {"price": 0, "carrier": "N/A"}), "live": False}
 
 
 async def main():
     print("=== Retrying PSP + DPS (multi-URL format) ===")
-    results = []
-    for task in RETRY_TASKS:
-        r = await scrape_with_retry(task)
-        results.append(r)
+    try:
+        # One browser for both routes, scraped side by side
+        async with async_playwright() as p:
+            browser = await launch_browser(p)
+            try:
+                results = await gather_bounded(lambda task: scrape_with_retry(browser, task), RETRY_TASKS)
+            finally:
+                await browser.close()
+    except Exception as e:
+        print(f"Playwright failed: {e}. Using mock.")
+        results = [mock_result(task) for task in RETRY_TASKS]
 
     print("\n=== FINAL RESULTS ===")
     for r in results:
         live_label = "🟢 LIVE" if r["live"] else "🟡 MOCK"
         print(f"  {r['route']}: ${r['best']['price']} ({r['best']['carrier']}) [{live_label}]")
 
-    # Patch price_history.json with any live results
-    if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE) as f:
-            history = json.load(f)
+    # Patch price_history.json with any live results (one entry per task per day);
+    # mock-only runs leave the file untouched
+    live = [r for r in results if r.get("live")]
+    if live:
+        history = load_history()
         today = datetime.date.today().isoformat()
-        for r in results:
-            if r.get("live"):
-                if r["task_id"] not in history:
-                    history[r["task_id"]] = {}
-                history[r["task_id"]][today] = r["best"]
-        with open(HISTORY_FILE, "w") as f:
-            json.dump(history, f, indent=4)
+        for r in live:
+            record_price(history, r["task_id"], {"date": today, **r["best"]})
+        save_history(history)
         print("Price history updated.")
 
 if __name__ == "__main__":